@@ -1,8 +1,397 @@
+import csv
+import glob
+import itertools
+import os
+import shutil
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
 import duckdb
 
+# A single in-memory DuckDB database is shared by every ElectricVehiclePopulation
+# context. Each CSV is loaded into a table of its own, keyed by its (path, mtime,
+# size), so re-entering the context manager for an unchanged file does not pay
+# for engine start-up and a full CSV load, while contexts over different files
+# (or over different versions of one file) never see each other's rows.
+#
+# A table is kept while any context uses it. Once idle, a table for a superseded
+# version of its file is dropped right away, and only the _MAX_IDLE_TABLES most
+# recently used idle tables are kept for reuse. This bookkeeping is not
+# thread-safe: contexts must be entered and exited from a single thread.
+_MAX_IDLE_TABLES = 2
+
+CacheKey = Tuple[str, int, int]
+
+_conn: Optional[duckdb.DuckDBPyConnection] = None
+_tables: Dict[CacheKey, str] = {}
+_latest_keys: Dict[str, CacheKey] = {}
+_table_refs: Dict[CacheKey, int] = {}
+# Idle tables, least recently used first.
+_idle_keys: "OrderedDict[CacheKey, None]" = OrderedDict()
+_table_ids = itertools.count()
+
+
+def _drop_table(key: CacheKey) -> None:
+    _conn.execute(f"DROP TABLE {_tables.pop(key)};")
+    del _table_refs[key]
+    _idle_keys.pop(key, None)
+    if _latest_keys.get(key[0]) == key:
+        del _latest_keys[key[0]]
+
+
+def _evict_idle_tables() -> None:
+    for key in list(_idle_keys):
+        if _latest_keys.get(key[0]) != key:
+            _drop_table(key)
+    while len(_idle_keys) > _MAX_IDLE_TABLES:
+        _drop_table(next(iter(_idle_keys)))
+
+
+class ElectricVehiclePopulation:
+    """
+    Electric Vehicle Population data, loaded from CSV into an in-memory DuckDB table.
+    """
+
+    _CSV_COLUMNS = (
+        "VIN (1-10)",
+        "County",
+        "City",
+        "State",
+        "Postal Code",
+        "Model Year",
+        "Make",
+        "Model",
+        "Electric Vehicle Type",
+        "Clean Alternative Fuel Vehicle (CAFV) Eligibility",
+        "Electric Range",
+        "Base MSRP",
+        "Legislative District",
+        "DOL Vehicle ID",
+        "Vehicle Location",
+        "Electric Utility",
+        "2020 Census Tract",
+    )
+
+    _CREATE_TABLE = """
+        CREATE TABLE {table} (
+            VIN_1_10 VARCHAR NOT NULL,
+            County VARCHAR,
+            City VARCHAR,
+            State VARCHAR NOT NULL,
+            Postal_Code VARCHAR NOT NULL,
+            Model_Year USMALLINT NOT NULL,
+            Make VARCHAR NOT NULL,
+            Model VARCHAR,
+            Vehicle VARCHAR,
+            Electric_Vehicle_Type VARCHAR NOT NULL,
+            Clean_Alternative_Fuel_Vehicle_CAFV_Eligibility VARCHAR NOT NULL,
+            Electric_Range USMALLINT NOT NULL,
+            Base_MSRP UINTEGER NOT NULL,
+            Legislative_District USMALLINT,
+            DOL_Vehicle_ID UINTEGER NOT NULL,
+            Longitude DOUBLE,
+            Latitude DOUBLE,
+            Electric_Utility VARCHAR,
+            y_2020_Census_Tract VARCHAR
+        );
+    """
+
+    # Parsing and type coercion is done by DuckDB's native CSV reader: every
+    # field is read as VARCHAR and explicitly CAST to the table type, so a
+    # malformed value fails the load instead of being silently sniffed. The
+    # layout is given up front (and the header checked in Python), which skips
+    # the dialect / type sniffing pass over the file.
+    _LOAD_CSV = """
+        INSERT INTO {table}
+        SELECT
+            "VIN (1-10)",
+            County,
+            City,
+            State,
+            -- Postal codes and census tracts are identifier codes: kept as
+            -- VARCHAR so leading zeros survive, but their format is checked.
+            CASE
+                WHEN regexp_full_match("Postal Code", '[0-9]{{5}}') THEN "Postal Code"
+                ELSE error('Invalid postal code: ' || coalesce("Postal Code", ''))
+            END,
+            CAST("Model Year" AS USMALLINT),
+            Make,
+            Model,
+            Make || ' ' || Model,
+            "Electric Vehicle Type",
+            "Clean Alternative Fuel Vehicle (CAFV) Eligibility",
+            CAST("Electric Range" AS USMALLINT),
+            CAST("Base MSRP" AS UINTEGER),
+            CAST("Legislative District" AS USMALLINT),
+            CAST("DOL Vehicle ID" AS UINTEGER),
+            CAST(Location[1] AS DOUBLE),
+            CAST(Location[2] AS DOUBLE),
+            "Electric Utility",
+            CASE
+                WHEN "2020 Census Tract" IS NULL THEN NULL
+                WHEN regexp_full_match("2020 Census Tract", '[0-9]{{11}}')
+                    THEN "2020 Census Tract"
+                ELSE error('Invalid 2020 census tract: ' || "2020 Census Tract")
+            END
+        FROM (
+            SELECT
+                *,
+                -- "POINT (lon lat)": fixed prefix / suffix, so slice and split
+                -- instead of running a regex over every row.
+                CASE
+                    WHEN "Vehicle Location" IS NULL THEN NULL
+                    WHEN "Vehicle Location" LIKE 'POINT (%%)'
+                        AND len(string_split("Vehicle Location"[8:-2], ' ')) = 2
+                        THEN string_split("Vehicle Location"[8:-2], ' ')
+                    ELSE error('Invalid point string format: ' || "Vehicle Location")
+                END AS Location
+            FROM read_csv(
+                ?,
+                header = true,
+                auto_detect = false,
+                delim = ',',
+                quote = '"',
+                escape = '"',
+                columns = {{%s}}
+            )
+        );
+    """ % ", ".join(f"'{name}': 'VARCHAR'" for name in _CSV_COLUMNS)
+
+    # Rows are pulled from DuckDB this many at a time by the iter_* methods.
+    _FETCH_SIZE = 2048
+
+    def __init__(self, csv_path: str):
+        self._csv_path = csv_path
+
+    def _check_csv_header(self) -> None:
+        with open(self._csv_path, newline="") as io:
+            header = tuple(next(csv.reader(io), ()))
+        if header != self._CSV_COLUMNS:
+            raise ValueError(f"Unexpected CSV header in {self._csv_path}: {header}")
+
+    def __enter__(self) -> "ElectricVehiclePopulation":
+        global _conn
+        if _conn is None:
+            # Every query orders its own output, so DuckDB is free to reorder
+            # rows inside its parallel load / aggregate pipelines.
+            _conn = duckdb.connect(config={"preserve_insertion_order": False})
+        stat = os.stat(self._csv_path)
+        key = (os.path.abspath(self._csv_path), stat.st_mtime_ns, stat.st_size)
+        table = _tables.get(key)
+        if table is None:
+            self._check_csv_header()
+            table = f"electric_vehicles_population_{next(_table_ids)}"
+            _conn.execute(self._CREATE_TABLE.format(table=table))
+            try:
+                try:
+                    _conn.execute(
+                        self._LOAD_CSV.format(table=table), [self._csv_path]
+                    )
+                except duckdb.Error as e:
+                    raise ValueError(f"Failed to load {self._csv_path}: {e}") from e
+            except BaseException:
+                # Not yet in _tables, so nothing else would ever drop it.
+                _conn.execute(f"DROP TABLE {table};")
+                raise
+            _tables[key] = table
+            _table_refs[key] = 0
+        _latest_keys[key[0]] = key
+        _table_refs[key] += 1
+        _idle_keys.pop(key, None)
+        _evict_idle_tables()
+        self._conn = _conn
+        self._key = key
+        self._table = table
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # The connection is shared with later contexts, so it is left open.
+        _table_refs[self._key] -= 1
+        if not _table_refs[self._key]:
+            _idle_keys[self._key] = None
+        _evict_idle_tables()
+        del self._conn, self._key, self._table
+
+    def _iter_rows(
+        self, query: str, parameters: Sequence[Any] = ()
+    ) -> Iterator[Tuple[Any, ...]]:
+        # The query runs now, on a cursor of its own, so the returned iterator
+        # reflects the table at call time, keeps working after __exit__ and is
+        # not clobbered by other queries on the shared connection.
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(query, parameters)
+        except BaseException:
+            cursor.close()
+            raise
+        return self._fetch_rows(cursor)
+
+    def _fetch_rows(
+        self, cursor: duckdb.DuckDBPyConnection
+    ) -> Iterator[Tuple[Any, ...]]:
+        try:
+            while True:
+                rows = cursor.fetchmany(self._FETCH_SIZE)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+    def iter_cars_by_city(
+        self, limit: Optional[int] = None
+    ) -> Iterator[Tuple[str, int]]:
+        """
+        Stream (city, count) for the number of electric cars per city, most
+        popular first. When limit is given, only that many cities are returned,
+        which lets DuckDB use a top-N heap instead of sorting every city.
+        """
+        query = f"""
+            SELECT City, COUNT(*) AS Count
+            FROM {self._table}
+            GROUP BY City
+            ORDER BY Count DESC, City
+        """
+        parameters = []
+        if limit is not None:
+            if limit < 0:
+                raise ValueError(f"limit must not be negative: {limit}")
+            query += " LIMIT ?"
+            parameters.append(limit)
+        return self._iter_rows(query, parameters)
+
+    def count_cars_by_city(self, limit: Optional[int] = None) -> Dict[str, int]:
+        """
+        Count the number of electric cars per city, most popular first.
+        """
+        return dict(self.iter_cars_by_city(limit))
+
+    def iter_top_3_electric_vehicles(self) -> Iterator[Tuple[int, str, int]]:
+        """
+        Stream (rank, vehicle, count) for the top 3 most popular electric vehicles.
+        """
+        return self._iter_rows(
+            f"""
+            SELECT Rank, Vehicle, Count
+            FROM (
+                SELECT
+                    DENSE_RANK() OVER (ORDER BY COUNT(*) DESC) AS Rank,
+                    Vehicle,
+                    COUNT(*) AS Count
+                FROM {self._table}
+                GROUP BY Vehicle
+            )
+            WHERE Rank <= 3
+            ORDER BY Rank, Vehicle;
+            """
+        )
+
+    def top_3_electric_vehicles(self) -> List[Tuple[int, str, int]]:
+        """
+        Find the top 3 most popular electric vehicles, as (rank, vehicle, count).
+        """
+        return list(self.iter_top_3_electric_vehicles())
+
+    def iter_most_popular_by_postal_code(
+        self,
+    ) -> Iterator[Tuple[str, List[Tuple[str, int]]]]:
+        """
+        Stream (postal code, [(vehicle, count), ...]) for the most popular
+        electric vehicle in each postal code (more than one on a tie).
+        """
+        rows = self._iter_rows(
+            f"""
+            SELECT
+                Postal_Code,
+                LIST({{'Vehicle': Vehicle, 'Count': Count}} ORDER BY Vehicle) AS Vehicles
+            FROM (
+                SELECT
+                    DENSE_RANK() OVER (PARTITION BY Postal_Code ORDER BY COUNT(*) DESC) AS Rank,
+                    Postal_Code,
+                    Vehicle,
+                    COUNT(*) AS Count
+                FROM {self._table}
+                GROUP BY Postal_Code, Vehicle
+            )
+            WHERE Rank = 1
+            GROUP BY Postal_Code
+            ORDER BY Postal_Code;
+            """
+        )
+        return (
+            (
+                postal_code,
+                [(vehicle["Vehicle"], vehicle["Count"]) for vehicle in vehicles],
+            )
+            for postal_code, vehicles in rows
+        )
+
+    def most_popular_by_postal_code(self) -> Dict[str, List[Tuple[str, int]]]:
+        """
+        Find the most popular electric vehicle in each postal code, as a list of
+        (vehicle, count) per postal code (more than one on a tie).
+        """
+        return dict(self.iter_most_popular_by_postal_code())
+
+    def count_cars_by_year(self, prefix: str) -> Dict[int, int]:
+        """
+        Count the number of electric cars by model year, writing the result as
+        Parquet files partitioned by year under prefix.
+        """
+        # The aggregate is computed once into a temporary table, which both the
+        # COPY and the returned counts read from.
+        self._conn.execute(
+            f"""
+            CREATE OR REPLACE TEMP TABLE cars_by_year AS
+            SELECT Model_Year, COUNT(*) AS Count
+            FROM {self._table}
+            GROUP BY Model_Year;
+            """
+        )
+        try:
+            # Partitions from an earlier run are removed first, so none that
+            # are no longer in the aggregate linger. Only Model_Year=*
+            # directories are touched: anything else under prefix is kept.
+            for partition in glob.glob(
+                os.path.join(glob.escape(prefix), "Model_Year=*")
+            ):
+                if os.path.isdir(partition):
+                    shutil.rmtree(partition)
+            self._conn.execute(
+                f"""
+                COPY cars_by_year
+                TO '{prefix.replace("'", "''")}' (FORMAT PARQUET, PARTITION_BY (Model_Year), OVERWRITE_OR_IGNORE);
+                """
+            )
+            return dict(
+                self._conn.execute(
+                    "SELECT Model_Year, Count FROM cars_by_year ORDER BY Model_Year;"
+                ).fetchall()
+            )
+        finally:
+            self._conn.execute("DROP TABLE cars_by_year;")
+
 
 def main():
-    pass
+    with ElectricVehiclePopulation("data/Electric_Vehicle_Population_Data.csv") as evp:
+        print("Electric cars per city:")
+        for city, count in evp.iter_cars_by_city():
+            print(f"  {city}: {count}")
+
+        print("Top 3 electric vehicles:")
+        for rank, vehicle, count in evp.iter_top_3_electric_vehicles():
+            print(f"  {rank}. {vehicle}: {count}")
+
+        print("Most popular electric vehicle by postal code:")
+        for postal_code, vehicles in evp.iter_most_popular_by_postal_code():
+            print(
+                f"  {postal_code}: "
+                + ", ".join(f"{vehicle} ({count})" for vehicle, count in vehicles)
+            )
+
+        print("Electric cars by model year:")
+        for model_year, count in evp.count_cars_by_year("cars_by_year").items():
+            print(f"  {model_year}: {count}")
 
 
 if __name__ == "__main__":
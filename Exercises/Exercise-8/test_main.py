@@ -0,0 +1,322 @@
+import os
+
+import duckdb
+
+import pytest
+
+import main
+from main import ElectricVehiclePopulation
+
+HEADER = (
+    "VIN (1-10),County,City,State,Postal Code,Model Year,Make,Model,"
+    "Electric Vehicle Type,Clean Alternative Fuel Vehicle (CAFV) Eligibility,"
+    "Electric Range,Base MSRP,Legislative District,DOL Vehicle ID,"
+    "Vehicle Location,Electric Utility,2020 Census Tract"
+)
+
+
+def csv_row(
+    city="Yakima",
+    state="WA",
+    postal_code="98908",
+    make="TESLA",
+    model="MODEL 3",
+    vehicle_location="POINT (-120.56916 46.58514)",
+    census_tract="53077000904",
+):
+    return (
+        f"5YJ3E1EB4L,Yakima,{city},{state},{postal_code},2020,{make},{model},"
+        "Battery Electric Vehicle (BEV),Clean Alternative Fuel Vehicle Eligible,"
+        f"322,0,14,127175366,{vehicle_location},PACIFICORP,{census_tract}"
+    )
+
+
+def write_csv(path, *rows):
+    path.write_text("\n".join((HEADER,) + rows) + "\n")
+    return str(path)
+
+
+def test_load_vehicle_location(tmp_path):
+    csv_path = write_csv(
+        tmp_path / "evp.csv", csv_row(), csv_row(vehicle_location="")
+    )
+    with ElectricVehiclePopulation(csv_path) as evp:
+        assert evp._conn.execute(
+            f"SELECT Longitude, Latitude FROM {evp._table} ORDER BY Longitude"
+        ).fetchall() == [(-120.56916, 46.58514), (None, None)]
+
+
+@pytest.mark.parametrize(
+    "vehicle_location",
+    ["POINT (1)", "POINT (1 2 3)", "POINT(1 2)", "POINT (a b)", "(1 2)"],
+)
+def test_load_invalid_vehicle_location(tmp_path, vehicle_location):
+    csv_path = write_csv(
+        tmp_path / "evp.csv", csv_row(vehicle_location=vehicle_location)
+    )
+    with pytest.raises(ValueError):
+        with ElectricVehiclePopulation(csv_path):
+            pass
+
+
+def test_load_blank_not_null_field(tmp_path):
+    csv_path = write_csv(tmp_path / "evp.csv", csv_row(state=""))
+    with pytest.raises(ValueError):
+        with ElectricVehiclePopulation(csv_path):
+            pass
+
+
+def test_load_codes_keep_leading_zeros(tmp_path):
+    csv_path = write_csv(
+        tmp_path / "evp.csv", csv_row(postal_code="01730", census_tract="06073005102")
+    )
+    with ElectricVehiclePopulation(csv_path) as evp:
+        assert evp._conn.execute(
+            f"SELECT Postal_Code, y_2020_Census_Tract FROM {evp._table}"
+        ).fetchall() == [("01730", "06073005102")]
+
+
+@pytest.mark.parametrize(
+    "codes",
+    [
+        {"postal_code": "abc"},
+        {"postal_code": "9890"},
+        {"postal_code": "989080"},
+        {"census_tract": "5307700090"},
+        {"census_tract": "5307700090x"},
+    ],
+)
+def test_load_invalid_codes(tmp_path, codes):
+    csv_path = write_csv(tmp_path / "evp.csv", csv_row(**codes))
+    with pytest.raises(ValueError):
+        with ElectricVehiclePopulation(csv_path):
+            pass
+
+
+class InterruptedLoad:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, query, *args):
+        if "INSERT INTO" in query:
+            raise KeyboardInterrupt
+        return self._conn.execute(query, *args)
+
+
+@pytest.mark.parametrize(
+    "row, exception",
+    [(csv_row(state=""), ValueError), (csv_row(), KeyboardInterrupt)],
+    ids=["invalid_row", "interrupted"],
+)
+def test_failed_load_drops_its_table(tmp_path, monkeypatch, row, exception):
+    with ElectricVehiclePopulation(write_csv(tmp_path / "warm_up.csv", csv_row())):
+        conn = main._conn
+    if exception is KeyboardInterrupt:
+        monkeypatch.setattr(main, "_conn", InterruptedLoad(conn))
+    csv_path = write_csv(tmp_path / "evp.csv", row)
+    with pytest.raises(exception):
+        with ElectricVehiclePopulation(csv_path):
+            pass
+    assert conn.execute(
+        "SELECT table_name FROM duckdb_tables() WHERE table_name NOT IN ?",
+        [list(main._tables.values())],
+    ).fetchall() == []
+
+
+def test_contexts_over_different_csvs(tmp_path):
+    a_path = write_csv(tmp_path / "a.csv", csv_row(city="Seattle"))
+    b_path = write_csv(
+        tmp_path / "b.csv", csv_row(city="Tacoma"), csv_row(city="Tacoma")
+    )
+    with ElectricVehiclePopulation(a_path) as a:
+        with ElectricVehiclePopulation(b_path) as b:
+            assert a.count_cars_by_city() == {"Seattle": 1}
+            assert b.count_cars_by_city() == {"Tacoma": 2}
+        assert a.count_cars_by_city() == {"Seattle": 1}
+        with ElectricVehiclePopulation(a_path) as a_again:
+            assert a_again.count_cars_by_city() == {"Seattle": 1}
+
+
+def test_reload_on_size_change(tmp_path):
+    csv_path = write_csv(tmp_path / "evp.csv", csv_row(city="Seattle"))
+    with ElectricVehiclePopulation(csv_path) as before:
+        write_csv(
+            tmp_path / "evp.csv", csv_row(city="Seattle"), csv_row(city="Tacoma")
+        )
+        with ElectricVehiclePopulation(csv_path) as after:
+            assert after.count_cars_by_city() == {"Seattle": 1, "Tacoma": 1}
+        assert before.count_cars_by_city() == {"Seattle": 1}
+
+
+def test_reload_on_mtime_change(tmp_path):
+    csv_path = write_csv(tmp_path / "evp.csv", csv_row(city="Seattle"))
+    with ElectricVehiclePopulation(csv_path) as evp:
+        assert evp.count_cars_by_city() == {"Seattle": 1}
+    stat = os.stat(csv_path)
+    write_csv(tmp_path / "evp.csv", csv_row(city="Everett"))
+    os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert os.stat(csv_path).st_size == stat.st_size
+    with ElectricVehiclePopulation(csv_path) as evp:
+        assert evp.count_cars_by_city() == {"Everett": 1}
+
+
+def loaded_tables():
+    return sorted(
+        table
+        for (table,) in main._conn.execute(
+            "SELECT table_name FROM duckdb_tables()"
+        ).fetchall()
+    )
+
+
+def test_idle_tables_are_evicted(tmp_path):
+    paths = [
+        write_csv(tmp_path / f"{i}.csv", csv_row())
+        for i in range(main._MAX_IDLE_TABLES + 2)
+    ]
+    with ElectricVehiclePopulation(paths[0]) as first:
+        table = first._table
+    with ElectricVehiclePopulation(paths[0]) as again:
+        assert again._table == table
+    with ElectricVehiclePopulation(paths[1]) as second:
+        for path in paths[2:]:
+            with ElectricVehiclePopulation(path):
+                pass
+        assert second._table in loaded_tables()
+    assert table not in loaded_tables()
+    assert len(loaded_tables()) == main._MAX_IDLE_TABLES
+    assert loaded_tables() == sorted(main._tables.values())
+
+
+def test_count_cars_by_year(tmp_path):
+    csv_path = write_csv(tmp_path / "evp.csv", csv_row(), csv_row())
+    prefix = tmp_path / "cars_by_year 'quoted'"
+    (prefix / "Model_Year=1900").mkdir(parents=True)
+    (prefix / "Model_Year=1900" / "stale.parquet").write_text("stale")
+    with ElectricVehiclePopulation(csv_path) as evp:
+        assert evp.count_cars_by_year(str(prefix)) == {2020: 2}
+    assert not (prefix / "Model_Year=1900").exists()
+    assert duckdb.execute(
+        "SELECT Model_Year, Count FROM read_parquet(?, hive_partitioning = true)",
+        [str(prefix / "*" / "*.parquet")],
+    ).fetchall() == [(2020, 2)]
+
+
+def test_iterators_run_when_called(tmp_path):
+    csv_path = write_csv(tmp_path / "evp.csv", csv_row(city="Seattle"))
+    with ElectricVehiclePopulation(csv_path) as evp:
+        cars_by_city = evp.iter_cars_by_city()
+        top_3 = evp.iter_top_3_electric_vehicles()
+        by_postal_code = evp.iter_most_popular_by_postal_code()
+    write_csv(tmp_path / "evp.csv", csv_row(city="Tacoma"), csv_row(city="Tacoma"))
+    with ElectricVehiclePopulation(csv_path):
+        assert list(cars_by_city) == [("Seattle", 1)]
+    assert list(top_3) == [(1, "TESLA MODEL 3", 1)]
+    assert list(by_postal_code) == [("98908", [("TESLA MODEL 3", 1)])]
+
+
+def test_count_cars_by_year_keeps_unrelated_files(tmp_path):
+    csv_path = write_csv(tmp_path / "evp.csv", csv_row())
+    prefix = tmp_path / "out"
+    (prefix / "keep").mkdir(parents=True)
+    (prefix / "keep" / "f.py").write_text("keep")
+    (prefix / "important.txt").write_text("keep")
+    with ElectricVehiclePopulation(csv_path) as evp:
+        assert evp.count_cars_by_year(str(prefix)) == {2020: 1}
+        assert evp.count_cars_by_year(str(prefix)) == {2020: 1}
+    assert (prefix / "keep" / "f.py").read_text() == "keep"
+    assert (prefix / "important.txt").read_text() == "keep"
+    assert sorted(os.listdir(prefix)) == ["Model_Year=2020", "important.txt", "keep"]
+
+
+def test_count_cars_by_city(tmp_path):
+    csv_path = write_csv(
+        tmp_path / "evp.csv",
+        *[csv_row(city="Tacoma")] * 2,
+        csv_row(city="Yakima"),
+        *[csv_row(city="Seattle")] * 3,
+        *[csv_row(city="Bellevue")] * 2,
+    )
+    with ElectricVehiclePopulation(csv_path) as evp:
+        assert list(evp.count_cars_by_city().items()) == [
+            ("Seattle", 3),
+            ("Bellevue", 2),
+            ("Tacoma", 2),
+            ("Yakima", 1),
+        ]
+
+
+def test_top_3_electric_vehicles_with_ties(tmp_path):
+    csv_path = write_csv(
+        tmp_path / "evp.csv",
+        *[csv_row(make="TESLA", model="MODEL 3")] * 4,
+        *[csv_row(make="NISSAN", model="LEAF")] * 2,
+        *[csv_row(make="BMW", model="I3")] * 2,
+        csv_row(make="KIA", model="NIRO"),
+        csv_row(make="FORD", model="FUSION"),
+    )
+    with ElectricVehiclePopulation(csv_path) as evp:
+        assert evp.top_3_electric_vehicles() == [
+            (1, "TESLA MODEL 3", 4),
+            (2, "BMW I3", 2),
+            (2, "NISSAN LEAF", 2),
+            (3, "FORD FUSION", 1),
+            (3, "KIA NIRO", 1),
+        ]
+
+
+def test_most_popular_by_postal_code(tmp_path):
+    csv_path = write_csv(
+        tmp_path / "evp.csv",
+        csv_row(postal_code="98101", make="NISSAN", model="LEAF"),
+        *[csv_row(postal_code="98101", make="TESLA", model="MODEL 3")] * 2,
+        csv_row(postal_code="01730", make="KIA", model="NIRO"),
+    )
+    with ElectricVehiclePopulation(csv_path) as evp:
+        assert list(evp.most_popular_by_postal_code().items()) == [
+            ("01730", [("KIA NIRO", 1)]),
+            ("98101", [("TESLA MODEL 3", 2)]),
+        ]
+
+
+def test_most_popular_by_postal_code_with_ties(tmp_path):
+    csv_path = write_csv(
+        tmp_path / "evp.csv",
+        *[csv_row(postal_code="98102", make="KIA", model="NIRO")] * 2,
+        csv_row(postal_code="98102", make="FORD", model="FUSION"),
+        *[csv_row(postal_code="98102", make="BMW", model="I3")] * 2,
+        csv_row(postal_code="98103", make="FORD", model="FUSION"),
+    )
+    with ElectricVehiclePopulation(csv_path) as evp:
+        assert evp.most_popular_by_postal_code() == {
+            "98102": [("BMW I3", 2), ("KIA NIRO", 2)],
+            "98103": [("FORD FUSION", 1)],
+        }
+        assert list(evp.iter_most_popular_by_postal_code()) == [
+            ("98102", [("BMW I3", 2), ("KIA NIRO", 2)]),
+            ("98103", [("FORD FUSION", 1)]),
+        ]
+
+
+def test_count_cars_by_city_limit(tmp_path):
+    csv_path = write_csv(
+        tmp_path / "evp.csv",
+        *[csv_row(city="Tacoma")] * 2,
+        csv_row(city="Yakima"),
+        *[csv_row(city="Seattle")] * 3,
+        *[csv_row(city="Bellevue")] * 2,
+    )
+    with ElectricVehiclePopulation(csv_path) as evp:
+        assert evp.count_cars_by_city(limit=0) == {}
+        assert list(evp.count_cars_by_city(limit=2).items()) == [
+            ("Seattle", 3),
+            ("Bellevue", 2),
+        ]
+        assert list(evp.iter_cars_by_city(limit=3)) == [
+            ("Seattle", 3),
+            ("Bellevue", 2),
+            ("Tacoma", 2),
+        ]
+        assert len(evp.count_cars_by_city(limit=10)) == 4
+        with pytest.raises(ValueError):
+            evp.iter_cars_by_city(limit=-1)